@@ -1,13 +1,19 @@
 import os
+import json
+import time
 import requests
 import math
+import boto3
+import botocore
 import datetime
 import logging
 import numpy as np
 from bs4 import BeautifulSoup
-from utilities import load_proxy_details, load_pickle
+from utilities import load_json, load_proxy_details, load_pickle
 logging.getLogger().setLevel(logging.INFO)
 
+s3 = boto3.resource('s3')
+
 def get_shopping_categories(proxies: dict, user_agents: dict) -> list:
     """Gets the grocery shopping categories from Tesco.
 
@@ -47,79 +53,172 @@ def get_shopping_categories(proxies: dict, user_agents: dict) -> list:
     return grocery_categories
 
 
-def get_page_num_per_category(grocery_categories: list, proxies: dict, user_agents: dict) -> dict:
-    """Calculates the number of pages per shopping category on Tesco assuming 48 items is listed per page.
+def get_category_page(category_path: str, proxies: dict, user_agent: str) -> tuple:
+    """Gets the first page of products in a category or subcategory and how many products it has.
+
+    Args:
+        category_path (str): Path of the category, e.g. fresh-food or fresh-food/fresh-fruit
+        proxies (dict): Dictionary containing SOCK5 proxy details
+        user_agent (str): User agent to use with GET requests
+
+    Returns:
+        num_items (int): Number of products in the category
+        soup (BeautifulSoup): Parsed first page of the category
+    """
+    URL = f"https://www.tesco.com/groceries/en-GB/shop/{category_path}/all?count=48"
+    page = requests.get(
+        URL,
+        headers={'User-agent': user_agent},
+        proxies=proxies,
+        timeout=120
+    )
+    soup = BeautifulSoup(page.content, "html.parser")
+
+    num_items = int(soup.find('div', class_='pagination__items-displayed').get_text().split(' ')[5])
+    return num_items, soup
+
+
+def get_subcategories(groc_cat: str, soup: BeautifulSoup) -> list:
+    """Finds the subcategories of a category from links on its first page of products.
+
+    Args:
+        groc_cat (str): Tesco grocery shopping category
+        soup (BeautifulSoup): Parsed first page of the category
+
+    Returns:
+        List of subcategory paths, e.g. fresh-food/fresh-fruit
+    """
+    subcategories = []
+    for link in soup.findAll('a'):
+        href = link.get('href') or ''
+        if f'/groceries/en-GB/shop/{groc_cat}/' not in href:
+            continue
+
+        sub_cat = href.split('?')[0].split(f'/shop/{groc_cat}/')[-1].split('/')[0]
+        if (len(sub_cat) > 0) and (sub_cat != 'all') and (f"{groc_cat}/{sub_cat}" not in subcategories):
+            subcategories.append(f"{groc_cat}/{sub_cat}")
+
+    return subcategories
+
+
+def update_category_tree(
+    category_tree: dict, grocery_categories: list, proxies: dict, user_agents: dict, max_age_days: int
+    ) -> dict:
+    """Updates the cached tree of categories, subcategories and their product counts.
+
+    The product count of every category is checked each run, but a category's subcategories are
+    only rediscovered and recounted if its product count has changed or its cached entry is older
+    than max_age_days. If any subcategory can't be counted the category is cached without its
+    subcategories so it's scraped as a whole. Products that move between subcategories without
+    changing the category's count are picked up by the missed products scrape.
 
     Args:
+        category_tree (dict): Cached tree, category as keys and dicts of num_items, updated date,
+            and subcategories (subcategory path as keys and number of products as values) as values
         grocery_categories (list): List of Tesco grocery shopping categories
         proxies (dict): Dictionary containing SOCK5 proxy details
+        user_agents (dict): Dictionary of common user agents to use with GET requests
+        max_age_days (int): Number of days before subcategories are refreshed regardless
 
     Returns:
-        Dictionary containing category as keys and number of pages as values
+        Updated category tree containing only the current categories
+    """
+    user_agent = user_agents[np.random.randint(low=0, high=len(user_agents)-1)]['useragent']
+    curr_date = datetime.datetime.today().date()
+    updated_tree = {}
+    skipped_requests = 0
+
+    for groc_cat in grocery_categories:
+        num_items, soup = get_category_page(groc_cat, proxies, user_agent)
+
+        cached = category_tree.get(groc_cat)
+        if (
+            (cached is not None)
+            and (cached['num_items'] == num_items)
+            and ((curr_date - datetime.date.fromisoformat(cached['updated'])).days < max_age_days)
+        ):
+            updated_tree[groc_cat] = cached
+            skipped_requests += len(cached['subcategories'])
+            continue
+
+        subcategories = {}
+        for sub_cat in get_subcategories(groc_cat, soup):
+            time.sleep(np.random.uniform(low=1, high=2))
+            try:
+                subcategories[sub_cat] = get_category_page(sub_cat, proxies, user_agent)[0]
+            except (requests.exceptions.RequestException, AttributeError, ValueError, IndexError) as ex:
+                logging.warning(f"Could not count products in {sub_cat}, scraping {groc_cat} as a whole: {ex}")
+                subcategories = {}
+                break
+        updated_tree[groc_cat] = {
+            'num_items': num_items,
+            'updated': curr_date.isoformat(),
+            'subcategories': subcategories
+        }
+        logging.info(f"Refreshed {len(subcategories)} subcategories of {groc_cat}")
+
+    logging.info(f"Cached category tree saved {skipped_requests} subcategory requests")
+    return updated_tree
+
+
+def get_page_num_per_category(category_tree: dict) -> tuple:
+    """Calculates the number of pages per shopping category on Tesco assuming 48 items is listed per page.
+    Categories are split into their subcategories when the subcategories' product counts add up to
+    the category's, otherwise the whole category is used so no products are left out.
+
+    Args:
+        category_tree (dict): Tree of categories, subcategories and their product counts
+
+    Returns:
+        groc_cat_pages (dict): Category or subcategory path as keys and number of pages as values
+        groc_cat_num_items (dict): Category as keys and number of products as values
     """
     groc_cat_pages = {}
     groc_cat_num_items = {}
-    user_agent_idx = np.random.randint(low=0, high=len(user_agents)-1)
 
-    for groc_cat in grocery_categories:
-        URL = f"https://www.tesco.com/groceries/en-GB/shop/{groc_cat}/all?count=48"
-        page = requests.get(
-            URL,
-            headers={'User-agent': user_agents[user_agent_idx]['useragent']},
-            proxies=proxies,
-            timeout=120
-        )
-        soup = BeautifulSoup(page.content, "html.parser")
-        
-        num_items = int(soup.find('div', class_='pagination__items-displayed').get_text().split(' ')[5])
-        max_pages = math.ceil(num_items / 48)
-        groc_cat_pages[groc_cat] = max_pages
-        groc_cat_num_items[groc_cat] = num_items
+    for groc_cat, cat_details in category_tree.items():
+        subcategories = cat_details['subcategories']
+        if (len(subcategories) > 0) and (sum(subcategories.values()) == cat_details['num_items']):
+            for sub_cat, num_items in subcategories.items():
+                if num_items > 0:
+                    groc_cat_pages[sub_cat] = math.ceil(num_items / 48)
+        else:
+            groc_cat_pages[groc_cat] = math.ceil(cat_details['num_items'] / 48)
+        groc_cat_num_items[groc_cat] = cat_details['num_items']
 
     return groc_cat_pages, groc_cat_num_items
 
 
 def partition_list(groc_cat_pages: dict, pages_per_partition: int) -> list:
-    """This code partitions the grocery cateory pages into a lists with each containing pages_per_partition number of pages.
-    I don't know how or why this works but it works exactly as it needs to. Don't touch it.
-    
+    """Partitions the grocery category pages into lists with each containing at most pages_per_partition
+    pages in total, a category's pages are split across consecutive partitions when it doesn't fit.
+
     Args:
         groc_cat_pages (dict): Dictionary which map grocery category to how many pages it has
         pages_per_partition (int): Number of pages in each partition
 
     Returns:
-        List of lists
+        List of lists of dicts containing the category and its first and last page in the partition
     """
-    counts = 0
     main_lst = []
-    for idx, (cat, pages) in enumerate(groc_cat_pages.items()):
-        if idx == 0:
-            part_list = []
-        cat_pages = pages
-        lst1 = {'category': cat, 'end_index': cat_pages}
-        
-        while (pages > 1):
-            pages -= 1
-            counts += 1
-            if counts == pages_per_partition:
-                lst1['start_index'] = pages
-                part_list.append(lst1)
+    part_list = []
+    pages_left = pages_per_partition
+    for cat, pages in groc_cat_pages.items():
+        start_index = 1
+        while start_index <= pages:
+            end_index = min(pages, start_index + pages_left - 1)
+            part_list.append({'category': cat, 'start_index': start_index, 'end_index': end_index})
+            pages_left -= end_index - start_index + 1
+            start_index = end_index + 1
+
+            if pages_left == 0:
                 main_lst.append(part_list)
-                
-                counts = 0
-                pages -= 1
-                lst1 = {'category': cat, 'end_index': pages}
                 part_list = []
-                
-        if pages == 0:
-            continue
-            
-        lst1['start_index'] = pages
-        part_list.append(lst1)
-        
-        if idx == len(groc_cat_pages)-1:
-            main_lst.append(part_list)
-            
+                pages_left = pages_per_partition
+
+    if len(part_list) > 0:
+        main_lst.append(part_list)
+
     return main_lst
 
 
@@ -148,13 +247,31 @@ def lambda_handler(event, context):
     grocery_categories = get_shopping_categories(proxies, user_agents)
     logging.info(f"Scraped Tesco grocery categories: {grocery_categories}")
 
-    # Get number of pages in each category
-    groc_cat_pages, groc_cat_num_items = get_page_num_per_category(grocery_categories, proxies)
+    # Load cached category tree and refresh categories that have changed
+    BUCKET = os.environ['BUCKET_NAME']
+    category_tree_key = "master_data/category_tree.json"
+    try:
+        category_tree = load_json(BUCKET, category_tree_key)
+    except botocore.exceptions.ClientError as ex:
+        category_tree = {}
+        logging.info("Category tree does not exist, creating one...")
+
+    category_tree = update_category_tree(
+        category_tree, grocery_categories, proxies, user_agents, int(os.environ['CATEGORY_TREE_MAX_AGE_DAYS'])
+    )
+    s3object = s3.Object(BUCKET, category_tree_key)
+    s3object.put(
+        Body=(bytes(json.dumps(category_tree).encode('UTF-8')))
+    )
+    logging.info("Saved updated category tree to S3")
+
+    # Get number of pages in each category or subcategory
+    groc_cat_pages, groc_cat_num_items = get_page_num_per_category(category_tree)
     logging.info(f"Number of pages for each category: {groc_cat_pages}")
 
     # Partition categories lists that sum to a total of x pages
     partitions = partition_list(groc_cat_pages, event["pages_per_partition"])
-    logging.info(f"Created {len(partitions)} partitions containing {event['pages_per_partition']} total pages each")
+    logging.info(f"Created {len(partitions)} partitions containing at most {event['pages_per_partition']} total pages each")
 
     return {
         'statusCode': 200,
@@ -1,121 +1,98 @@
 import os
-import json
 import requests
 import time
 import boto3
 import datetime
 import logging
 import numpy as np
-from bs4 import BeautifulSoup
-from utilities import load_pickle, load_proxy_details
+from parsers import parse_category_page
+from utilities import load_pickle, load_proxy_details, archive_raw_html, save_compressed, fetch_and_parse, ProductBatch, StageMetrics
 logging.getLogger().setLevel(logging.INFO)
 
 s3 = boto3.resource('s3')
 
-def scrape_categories(partitions: list, proxies: dict, user_agents: dict) -> dict:
+def fetch_page(URL: str, proxies: dict, user_agent: str) -> bytes:
+    """Downloads a page of products and then waits a while to avoid being blocked.
+
+    Args:
+        URL (str): URL of the page of products
+        proxies (dict): Proxy details to use with GET requests
+        user_agent (str): User agent to use with GET requests
+
+    Returns:
+        bytes: Raw HTML content of the page
+    """
+    page = requests.get(
+        URL,
+        headers={'User-agent': user_agent},
+        proxies=proxies,
+        timeout=120
+    )
+    time.sleep(np.random.uniform(low=8, high=12))
+    return page.content
+
+
+def scrape_categories(
+    partitions: list, proxies: dict, user_agents: dict, archive_bucket: str = None
+    ) -> ProductBatch:
     """Scrape each product from a given list of categories to get price per unit,
     price per weight or quantity, product ID, and its category hierarchy.
 
+    Pages are downloaded by FETCH_WORKERS threads and parsed by PARSE_PROCESSES processes
+    (or on this thread if 0) so that parsing doesn't hold up downloading.
+
     Args:
         partitions (list): List containing Tesco grocery shopping categories and page number ranges
         proxies (dict): Proxy details to use with GET requests
         user_agents (dict): Dictionary of common user agents to use with GET requests
+        archive_bucket (str): If given, raw HTML of each page is archived to this S3 bucket
 
     Returns:
-        prod_dict (dict): Dictionary containing details of products
+        prod_batch (ProductBatch): Batch containing details of products
     """
     base_URL = "https://www.tesco.com/groceries/en-GB/shop"
-    main_prod_dict = {}
+    prod_batch = ProductBatch()
     user_agent_idx = np.random.randint(low=0, high=len(user_agents)-1)
-    
-    for partition_dict in partitions:
-        for page_num in range(partition_dict["start_index"], partition_dict["end_index"]+1):
-            URL = f"{base_URL}/{partition_dict['category']}/all?page={page_num}&count=48"
-            page = requests.get(
-                URL,
-                headers={'User-agent': user_agents[user_agent_idx]['useragent']},
-                proxies=proxies,
-                timeout=120
+    curr_date = datetime.datetime.now().strftime("%Y-%m-%d")
+
+    page_jobs = [
+        (partition_dict, page_num)
+        for partition_dict in partitions
+        for page_num in range(partition_dict["start_index"], partition_dict["end_index"]+1)
+    ]
+
+    def fetch_job(job):
+        partition_dict, page_num = job
+        URL = f"{base_URL}/{partition_dict['category']}/all?page={page_num}&count=48"
+        content = fetch_page(URL, proxies, user_agents[user_agent_idx]['useragent'])
+        if archive_bucket:
+            archive_raw_html(
+                archive_bucket,
+                f"raw_html/{curr_date}/category_pages/{partition_dict['category']}/{page_num}.html.gz",
+                content
             )
-            soup = BeautifulSoup(page.content, "html.parser")
-            
-            product_list = soup.find_all("li", class_="product-list--list-item")
-            
-            prod_dict = {}
-            for idx, prod in enumerate(product_list, 0):
-                prod_name = prod.find('span', class_="styled__Text-sc-1xbujuz-1 ldbwMG beans-link__text").get_text()
-                prod_id = int(prod.find('div', class_="styles__StyledTiledContent-dvv1wj-3 bcglTg")['data-auto-id'])
-            
-                try:
-                    prod_price_per_unit = float(
-                        (prod
-                         .find('p', class_="styled__StyledHeading-sc-119w3hf-2 jWPEtj styled__Text-sc-8qlq5b-1 lnaeiZ beans-price__text")
-                         .get_text()
-                         .replace('£', '')
-                         .replace(',', '')
-                        )
-                    )
-                except AttributeError:
-                    prod_price_per_unit = np.nan
-            
-                try:
-                    prod_price_per_weight_quant = float(
-                        (prod
-                         .find('p', class_="styled__StyledFootnote-sc-119w3hf-7 icrlVF styled__Subtext-sc-8qlq5b-2 bNJmdc beans-price__subtext")
-                         .get_text()
-                         .split('/')[0]
-                         .replace('£', '')
-                         .replace(',', '')
-                        )
-                    )
-                except AttributeError:
-                    prod_price_per_weight_quant = np.nan
-            
-                try:
-                    prod_weight_quant_unit = (
-                        prod
-                        .find('p', class_="styled__StyledFootnote-sc-119w3hf-7 icrlVF styled__Subtext-sc-8qlq5b-2 bNJmdc beans-price__subtext")
-                        .get_text()
-                        .split('/')[-1]
-                    )
-                except AttributeError:
-                    prod_weight_quant_unit = np.nan
-            
-                try:
-                    offer = (
-                        prod
-                         .find('div', class_='styles__StyledPromotionsOfferContent-sc-1vdpoop-1 cQQRuD')
-                         .find('span', class_='offer-text')
-                         .get_text()
-                    )
-                except AttributeError:
-                    offer = np.nan
-            
-                cat_dict = {}
-                for ele in prod.find_all('a', class_="styled__Anchor-sc-1xbujuz-0 cFilde beans-link__anchor"):
-                    if "/groceries/en-GB/shop/" in ele['href']:
-                        for idx, cat in enumerate(ele['href'].split('/')[4:], 1):
-                            cat_dict[f"category_{idx}"] = cat
-            
-                prod_dict[prod_id] = {
-                    'name': prod_name,
-                    'price_per_unit': prod_price_per_unit,
-                    'price_per_weight_quant': prod_price_per_weight_quant,
-                    'weight_quant_unit': prod_weight_quant_unit,
-                    'offer': offer
-                }
-                prod_dict[prod_id].update(cat_dict)
-
-            main_prod_dict.update(prod_dict)
-            print(f"Finished scraping page {page_num-partition_dict['start_index']+1} out of {partition_dict['end_index']-partition_dict['start_index']+1} for {' '.join(partition_dict['category'].split('-'))} category")
-            print(f"Scraped {len(prod_dict)} products")
-
-            time.sleep(np.random.uniform(low=8, high=12))
-
-    return main_prod_dict
+        return content
+
+    page_results = fetch_and_parse(
+        page_jobs,
+        fetch_fn=fetch_job,
+        parse_fn=parse_category_page,
+        num_fetchers=int(os.environ.get('FETCH_WORKERS', 1)),
+        num_parsers=int(os.environ.get('PARSE_PROCESSES', 0))
+    )
+    for (partition_dict, page_num), page_prods in page_results:
+        for prod_id, record in page_prods:
+            prod_batch.add(prod_id, record)
+
+        print(f"Finished scraping page {page_num-partition_dict['start_index']+1} out of {partition_dict['end_index']-partition_dict['start_index']+1} for {' '.join(partition_dict['category'].split('-'))} category")
+        print(f"Scraped {len(page_prods)} products")
+
+    return prod_batch
 
 
 def lambda_handler(event, context):
+    metrics = StageMetrics('scrape_categories')
+
     # Bucket containing project files
     BUCKET = os.environ['BUCKET_NAME']
     
@@ -129,15 +106,19 @@ def lambda_handler(event, context):
     )
 
     # Scrape products in partition categories
-    prod_dict = scrape_categories(event, proxy_dict, user_agents)
+    archive_bucket = BUCKET if os.environ.get('ARCHIVE_RAW_HTML', 'false').lower() == 'true' else None
+    prod_batch = scrape_categories(event, proxy_dict, user_agents, archive_bucket)
 
     # Save to S3 since the payload is too large to flow through step function
     curr_date = datetime.datetime.now().strftime("%Y-%m-%d")
-    key = f'raw_data/{curr_date}_partition_{np.random.randint(1e12, 2e12, 1)[0]}.json'
-    s3object = s3.Object(BUCKET, key)
-    s3object.put(
-        Body=(bytes(json.dumps(prod_dict).encode('UTF-8')))
+    key = save_compressed(BUCKET, f'raw_data/{curr_date}_partition_', prod_batch.iter_json_chunks())
+
+    # Save telemetry for the run metrics report
+    metrics['pages'] = sum(
+        partition_dict["end_index"] - partition_dict["start_index"] + 1 for partition_dict in event
     )
+    metrics['products'] = len(prod_batch)
+    metrics.save(BUCKET)
 
     return {
         'body': {
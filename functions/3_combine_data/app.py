@@ -1,13 +1,14 @@
-import json
+import os
 import boto3
 import datetime
 import logging
-from utilities import load_json
+from utilities import load_json_many, save_compressed, ProductBatch, StageMetrics
 logging.getLogger().setLevel(logging.INFO)
 
 s3 = boto3.resource('s3')
 
 def lambda_handler(event, context):
+    metrics = StageMetrics('combine_data')
 
     # Log the input
     logging.info(f"Input: {event}")
@@ -19,25 +20,27 @@ def lambda_handler(event, context):
             event['partition_results'][idx]['body']['key'] for idx in range(len(event['partition_results']))
         ]
     
-        # Load them in and combine into a single dict
-        combined_json = dict()
-        for key in partition_result_keys:
-            partition_result_json = load_json(
-                bucket=partition_result_bucket, key=key
-            )
-            combined_json.update(partition_result_json)
-        logging.info(f"Number of items in combined JSON: {len(combined_json)}")
+        # Load them in and combine into a single batch of compact product records
+        combined_batch = ProductBatch()
+        partition_result_jsons = load_json_many(
+            [(partition_result_bucket, key) for key in partition_result_keys]
+        )
+        for partition_result_json in partition_result_jsons:
+            combined_batch.update(partition_result_json)
+        logging.info(f"Number of items in combined JSON: {len(combined_batch)}")
     
         # Save combined JSON to S3
-        curr_datetime = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        save_key = f'intermediate_data/{curr_datetime}_combined_data.json'
-        s3object = s3.Object(
-            partition_result_bucket, save_key
-        )
-        s3object.put(
-            Body=(bytes(json.dumps(combined_json).encode('UTF-8')))
+        curr_date = datetime.datetime.now().strftime("%Y-%m-%d")
+        save_key = save_compressed(
+            partition_result_bucket,
+            f'intermediate_data/{curr_date}_combined_data_',
+            combined_batch.iter_json_chunks()
         )
         logging.info(f"Saved combined JSON to S3 at {save_key}")
+
+        # Save telemetry for the run metrics report
+        metrics['products'] = len(combined_batch)
+        metrics.save(os.environ['BUCKET_NAME'])
         
     # If empty then return None
     else:
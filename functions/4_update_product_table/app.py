@@ -4,12 +4,14 @@ import boto3
 import logging
 import math
 import botocore
-from utilities import load_json
+from utilities import load_json, StageMetrics
 logging.getLogger().setLevel(logging.INFO)
 
 s3 = boto3.resource('s3')
 
 def lambda_handler(event, context):
+    metrics = StageMetrics('update_product_table')
+
     # Load CSV of combined data
     combined_json = load_json(
         event["combined_json_paths"]["1"]["bucket"],
@@ -38,9 +40,11 @@ def lambda_handler(event, context):
         s3object = s3.Object(
             BUCKET, master_prod_key
         )
+        master_prods_body = bytes(json.dumps(master_prods_dict).encode('UTF-8'))
         s3object.put(
-            Body=(bytes(json.dumps(master_prods_dict).encode('UTF-8')))
+            Body=master_prods_body
         )
+        metrics.add_bytes_written(len(master_prods_body))
         logging.info(f"Saved updated master products table to S3")
 
     # Except create one if it doesn't exist and save to S3
@@ -52,9 +56,11 @@ def lambda_handler(event, context):
         s3object = s3.Object(
             BUCKET, master_prod_key
         )
+        master_prods_body = bytes(json.dumps(master_prods_dict).encode('UTF-8'))
         s3object.put(
-            Body=(bytes(json.dumps(master_prods_dict).encode('UTF-8')))
+            Body=master_prods_body
         )
+        metrics.add_bytes_written(len(master_prods_body))
         logging.info(f"Saved new master products table to S3")
 
     # Partition the list of missed products
@@ -78,5 +84,10 @@ def lambda_handler(event, context):
     else:
         partitions = []
 
+    # Save telemetry for the run metrics report
+    metrics['master_products'] = len(master_prods_dict)
+    metrics['missed_products'] = len(missed_prod_ids)
+    metrics['missed_product_ratio'] = len(missed_prod_ids) / max(len(master_prods_dict), 1)
+    metrics.save(BUCKET)
 
     return partitions
@@ -3,7 +3,7 @@ import boto3
 import datetime
 import logging
 import pandas as pd
-from utilities import load_json
+from utilities import load_json_many, StageMetrics
 logging.getLogger().setLevel(logging.INFO)
 
 s3 = boto3.resource('s3')
@@ -46,22 +46,19 @@ def convert_curr_to_float(curr: str):
         return None
 
 
-def lambda_handler(event, context):
-    # Load in combined JSONs and add to a master dict
-    all_data_json = {}
-    for path_idx in event["combined_json_paths"].keys():
-        if event["combined_json_paths"][path_idx]["key"] is None:
-            continue
-        else:
-            combined_json = load_json(
-                event["combined_json_paths"][path_idx]["bucket"],
-                event["combined_json_paths"][path_idx]["key"]
-            )
-            all_data_json.update(combined_json)
-    logging.info(f"Total of products scraped: {len(all_data_json)}")
+def postprocess_products(prod_dict: dict, date) -> pd.DataFrame:
+    """Converts scraped product details into a dataframe, calculates the Clubcard discount
+    percentage where there is one, and adds a column for the date the products were scraped.
 
+    Args:
+        prod_dict (dict): Dictionary containing details of products
+        date (datetime.date): Date the products were scraped
+
+    Returns:
+        pd.DataFrame
+    """
     # Convert dict into dataframe
-    prod_df = convert_dict_to_dataframe(all_data_json)
+    prod_df = convert_dict_to_dataframe(prod_dict)
     logging.info(f"Number of items in converted dataframe: {len(prod_df)}")
 
     # Calculate clubcard discount percentage
@@ -70,13 +67,38 @@ def lambda_handler(event, context):
     prod_df['clubcard_discount_perc'] =  100 * (1 - (prod_df['clubcard_price_per_unit'] / prod_df['price_per_unit']))
     
     # Add date column
-    prod_df['date'] = pd.Timestamp.today().date()
-    
+    prod_df['date'] = date
+
+    return prod_df
+
+
+def lambda_handler(event, context):
+    metrics = StageMetrics('postprocess_all_data')
+
+    # Load in combined JSONs and add to a master dict
+    all_data_json = {}
+    combined_json_paths = [
+        (event["combined_json_paths"][path_idx]["bucket"], event["combined_json_paths"][path_idx]["key"])
+        for path_idx in event["combined_json_paths"].keys()
+        if event["combined_json_paths"][path_idx]["key"] is not None
+    ]
+    for combined_json in load_json_many(combined_json_paths):
+        all_data_json.update(combined_json)
+    logging.info(f"Total of products scraped: {len(all_data_json)}")
+
+    # Convert into dataframe, calculate clubcard discount percentage and add date column
+    prod_df = postprocess_products(all_data_json, pd.Timestamp.today().date())
+
     # Save processed dataframe to S3
     BUCKET = os.environ['BUCKET_NAME']
     curr_datetime = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
     save_path = f's3://{BUCKET}/processed_data/{curr_datetime}_processed_data.csv'
     prod_df.to_csv(save_path, index=False)
     logging.info(f"Saved dataframe to S3 at {save_path}")
+    metrics.add_bytes_written(s3.Object(BUCKET, save_path.split(f's3://{BUCKET}/')[-1]).content_length)
+
+    # Save telemetry for the run metrics report
+    metrics['products'] = len(prod_df)
+    metrics.save(BUCKET)
 
     return save_path
\ No newline at end of file
@@ -2,11 +2,14 @@ import os
 import boto3
 import logging
 import pandas as pd
+from utilities import StageMetrics
 logging.getLogger().setLevel(logging.INFO)
 
 s3 = boto3.resource('s3')
 
 def lambda_handler(event, context):
+    metrics = StageMetrics('update_master_table')
+
     # Specify the dtypes of columns to cast
     convert_dict = {
         'id': str,
@@ -22,7 +25,9 @@ def lambda_handler(event, context):
     }
 
     # Load in scraped data from current run
+    BUCKET = os.environ['BUCKET_NAME']
     scraped_df = pd.read_csv(event)
+    metrics.add_bytes_read(s3.Object(BUCKET, event.split(f's3://{BUCKET}/')[-1]).content_length)
     logging.info(f"Number of rows in scraped data from current run: {len(scraped_df)}")
 
     # Cast columns types
@@ -30,10 +35,11 @@ def lambda_handler(event, context):
         scraped_df[col] = scraped_df[col].astype(dtype)
 
     # Try loading in master scraped data table
-    BUCKET = os.environ['BUCKET_NAME']
-    master_data_path = f"s3://{BUCKET}/master_data/scraped_product_data.parquet"
+    master_data_key = "master_data/scraped_product_data.parquet"
+    master_data_path = f"s3://{BUCKET}/{master_data_key}"
     try:
         master_df = pd.read_parquet(master_data_path)
+        metrics.add_bytes_read(s3.Object(BUCKET, master_data_key).content_length)
         logging.info(f"Number of rows in master scraped data table: {len(master_df)}")
 
         # Concatenate the two dataframes and save
@@ -46,4 +52,9 @@ def lambda_handler(event, context):
         scraped_df.to_parquet(master_data_path)
         logging.info("Could not find master scraped data table, saved current table as master")
 
+    # Save telemetry for the run metrics report
+    metrics.add_bytes_written(s3.Object(BUCKET, master_data_key).content_length)
+    metrics['rows'] = len(scraped_df)
+    metrics.save(BUCKET)
+
     return 200
\ No newline at end of file
@@ -0,0 +1,205 @@
+import os
+import boto3
+import datetime
+import logging
+import pandas as pd
+from utilities import load_json_many
+logging.getLogger().setLevel(logging.INFO)
+
+s3 = boto3.resource('s3')
+sfn = boto3.client('stepfunctions')
+sns = boto3.client('sns')
+
+# Metrics checked for regressions, and whether higher values are better
+REGRESSION_METRICS = {
+    'duration_secs': False,
+    'pages_per_sec': True,
+    'products_per_sec': True,
+    'products': True,
+    'retries': False,
+    'missed_product_ratio': False,
+}
+
+def get_state_metrics(execution_arn: str) -> tuple:
+    """Gets the wall clock duration of each state and the number of retried lambda
+    invocations from the execution history of the state machine.
+
+    Args:
+        execution_arn (str): ARN of the state machine execution
+
+    Returns:
+        state_durations (dict): State name as keys and duration in seconds as values
+        retries (int): Number of lambda invocations that failed and were retried
+    """
+    state_starts, state_ends = {}, {}
+    retries = 0
+    paginator = sfn.get_paginator('get_execution_history')
+    for page in paginator.paginate(executionArn=execution_arn, maxResults=1000):
+        for event in page['events']:
+            if 'stateEnteredEventDetails' in event:
+                name = event['stateEnteredEventDetails']['name']
+                state_starts[name] = min(state_starts.get(name, event['timestamp']), event['timestamp'])
+            elif 'stateExitedEventDetails' in event:
+                name = event['stateExitedEventDetails']['name']
+                state_ends[name] = max(state_ends.get(name, event['timestamp']), event['timestamp'])
+            elif event['type'] in ('LambdaFunctionFailed', 'LambdaFunctionTimedOut'):
+                retries += 1
+
+    state_durations = {
+        name: (state_ends[name] - state_starts[name]).total_seconds()
+        for name in state_starts.keys() if name in state_ends
+    }
+    return state_durations, retries
+
+
+def load_stage_metrics(bucket: str, start_date: datetime.datetime) -> list:
+    """Loads telemetry saved by the lambda functions during the execution. Telemetry is saved
+    under the UTC date each invocation finished on, so every date since the start is listed.
+
+    Args:
+        bucket (str): S3 bucket containing telemetry
+        start_date (datetime.datetime): Start time of the execution
+
+    Returns:
+        List of dicts, one for each lambda invocation
+    """
+    start_day = start_date.astimezone(datetime.timezone.utc).date()
+    num_days = (datetime.datetime.now(datetime.timezone.utc).date() - start_day).days + 1
+
+    keys = []
+    paginator = s3.meta.client.get_paginator('list_objects_v2')
+    for day in (start_day + datetime.timedelta(days=n) for n in range(num_days)):
+        for page in paginator.paginate(Bucket=bucket, Prefix=f"telemetry/{day.strftime('%Y-%m-%d')}/"):
+            keys.extend(obj['Key'] for obj in page.get('Contents', []) if obj['LastModified'] >= start_date)
+
+    return [
+        stage_metrics for stage_metrics in load_json_many([(bucket, key) for key in keys])
+        if datetime.datetime.fromisoformat(stage_metrics['timestamp']) >= start_date
+    ]
+
+
+def summarise_run(execution: dict, state_durations: dict, retries: int, stage_metrics: list) -> dict:
+    """Combines the state durations, retries and telemetry of an execution into one row of metrics.
+
+    Args:
+        execution (dict): Response of describe_execution for the execution
+        state_durations (dict): State name as keys and duration in seconds as values
+        retries (int): Number of lambda invocations that failed and were retried
+        stage_metrics (list): Telemetry saved by the lambda functions
+
+    Returns:
+        dict
+    """
+    def sum_metric(metric, stage=None):
+        return sum(m.get(metric, 0) for m in stage_metrics if stage is None or m['stage'] == stage)
+
+    pages = sum_metric('pages', 'scrape_categories') + sum_metric('pages', 'scrape_missed_products')
+    products = sum_metric('products', 'postprocess_all_data')
+    scrape_secs = state_durations.get('MapScrapeCategories', 0) + state_durations.get('MapScrapeMissedProducts', 0)
+    missed_product_ratios = [m['missed_product_ratio'] for m in stage_metrics if 'missed_product_ratio' in m]
+
+    run_metrics = {
+        'date': execution['startDate'].strftime('%Y-%m-%d'),
+        'execution_name': execution['name'],
+        'duration_secs': (datetime.datetime.now(datetime.timezone.utc) - execution['startDate']).total_seconds(),
+        'pages': pages,
+        'products': products,
+        'pages_per_sec': pages / scrape_secs if scrape_secs > 0 else None,
+        'products_per_sec': products / scrape_secs if scrape_secs > 0 else None,
+        'retries': retries,
+        'bytes_read': sum_metric('bytes_read'),
+        'bytes_written': sum_metric('bytes_written'),
+        'missed_product_ratio': missed_product_ratios[0] if len(missed_product_ratios) > 0 else None,
+    }
+    for name, duration in state_durations.items():
+        run_metrics[f'duration_secs_{name}'] = duration
+
+    return run_metrics
+
+
+def find_regressions(run_metrics: dict, history_df: pd.DataFrame, baseline_runs: int, threshold: float) -> list:
+    """Compares the metrics of the current run against the median of previous runs.
+
+    Args:
+        run_metrics (dict): Metrics of the current run
+        history_df (pd.DataFrame): Metrics of previous runs, oldest first
+        baseline_runs (int): Number of most recent previous runs to use as the baseline
+        threshold (float): Fraction a metric has to be worse than the baseline by to be flagged
+
+    Returns:
+        List of strings describing each regression
+    """
+    baseline_df = history_df.tail(baseline_runs)
+    if len(baseline_df) < min(3, baseline_runs):
+        logging.info(f"Only {len(baseline_df)} previous runs, not enough to compare against")
+        return []
+
+    regressions = []
+    for metric, higher_is_better in REGRESSION_METRICS.items():
+        if run_metrics.get(metric) is None or metric not in baseline_df.columns:
+            continue
+
+        baseline = baseline_df[metric].astype(float).median()
+        if pd.isna(baseline):
+            continue
+
+        # Metrics with a baseline of zero (e.g. retries) are flagged on any increase
+        if higher_is_better:
+            regressed = run_metrics[metric] < baseline * (1 - threshold)
+        else:
+            regressed = run_metrics[metric] > baseline * (1 + threshold)
+
+        if regressed:
+            regressions.append(f"{metric} was {run_metrics[metric]:.4g} against a baseline of {baseline:.4g}")
+
+    return regressions
+
+
+def lambda_handler(event, context):
+    # Get per state durations and retries of this execution
+    execution = sfn.describe_execution(executionArn=event['execution_arn'])
+    state_durations, retries = get_state_metrics(event['execution_arn'])
+    logging.info(f"Duration of each state in seconds: {state_durations}")
+
+    # Load telemetry saved by the lambda functions during this execution
+    BUCKET = os.environ['BUCKET_NAME']
+    stage_metrics = load_stage_metrics(BUCKET, execution['startDate'])
+    logging.info(f"Loaded telemetry from {len(stage_metrics)} lambda invocations")
+
+    run_metrics = summarise_run(execution, state_durations, retries, stage_metrics)
+    logging.info(f"Run metrics: {run_metrics}")
+
+    # Try loading in run metrics time series
+    run_metrics_path = f"s3://{BUCKET}/master_data/run_metrics.parquet"
+    try:
+        history_df = pd.read_parquet(run_metrics_path)
+        logging.info(f"Number of previous runs in run metrics table: {len(history_df)}")
+    except FileNotFoundError as ex:
+        history_df = pd.DataFrame()
+        logging.info("Could not find run metrics table, creating one")
+
+    # Flag any regressions against the rolling baseline
+    regressions = find_regressions(
+        run_metrics,
+        history_df,
+        baseline_runs=int(os.environ['BASELINE_RUNS']),
+        threshold=float(os.environ['REGRESSION_THRESHOLD'])
+    )
+    if len(regressions) > 0:
+        logging.warning(f"Performance regressions found: {regressions}")
+        sns.publish(
+            TopicArn=os.environ['REGRESSION_TOPIC_ARN'],
+            Subject="Tesco scrape pipeline performance regression",
+            Message=f"Execution {execution['name']} regressed against the last {os.environ['BASELINE_RUNS']} runs:\n"
+                    + "\n".join(regressions)
+        )
+
+    # Append current run and save
+    history_df = pd.concat([history_df, pd.DataFrame([run_metrics])], ignore_index=True)
+    history_df.to_parquet(run_metrics_path)
+    logging.info(f"Saved run metrics table with {len(history_df)} runs")
+
+    return {
+        'run_metrics': run_metrics,
+        'regressions': regressions
+    }
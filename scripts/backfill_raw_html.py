@@ -0,0 +1,227 @@
+"""Re-parses archived raw HTML for past days and rewrites those days in the master scraped data table.
+
+The scraping lambda functions archive gzipped raw HTML of every page under raw_html/{date}/ when
+their ARCHIVE_RAW_HTML environment variable is set to "true". This script downloads a day's pages
+concurrently, parses them across a pool of processes using the same parsers as the lambda functions,
+postprocesses them the same way as the pipeline, and replaces that day's rows in the master table.
+
+Category pages are parsed with lxml XPath queries by default, which is far faster than the
+BeautifulSoup parser the lambda functions use. Every --verify-every'th category page is also parsed
+with the lambda functions' parser, and the master table isn't rewritten if any results differ. Pass
+--html-parser html.parser to parse every page exactly as the lambda functions do.
+
+Example usage, against a local S3 stand-in such as MinIO:
+
+    python scripts/backfill_raw_html.py --bucket tesco-scrape-bucket --dates 2022-04-01 2022-04-02 \
+        --endpoint-url http://localhost:9000
+"""
+import os
+import sys
+import argparse
+import gzip
+import json
+import logging
+import importlib.util
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+logging.getLogger().setLevel(logging.INFO)
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'util_layer'))
+
+DEFAULT_HTML_PARSER = 'lxml' if importlib.util.find_spec('lxml') else 'html.parser'
+
+
+def page_prods_to_json(page_prods: list) -> list:
+    """Serialises parsed products for comparing the results of two parsers."""
+    return [(str(prod_id), ''.join(record.iter_json_chunks())) for prod_id, record in page_prods]
+
+
+def parse_archived_page(key: str, gz_content: bytes, html_parser: str, verify: bool) -> tuple:
+    """Decompresses and parses an archived page, runs inside a parser process.
+
+    Product pages are always parsed the same way as in the lambda functions, there are too few of
+    them for lxml to be worth it.
+
+    Args:
+        key (str): Path within bucket of the archived page
+        gz_content (bytes): Gzip compressed raw HTML of the page
+        html_parser (str): lxml to parse category pages with lxml XPath queries, or html.parser
+        verify (bool): Whether to also parse a category page with the lambda functions' parser and
+            compare the results, the lambda functions' result is used if they differ
+
+    Returns:
+        key (str): Path within bucket of the archived page
+        page_prods (list): List of (product ID, ProductRecord) tuples found on the page
+        mismatch (bool): Whether the page was verified and the results of the two parsers differed
+    """
+    from parsers import parse_category_page, parse_category_page_lxml, parse_product_page
+
+    content = gzip.decompress(gz_content)
+    if '/category_pages/' not in key:
+        prod_id = key.split('/')[-1].split('.')[0]
+        record = parse_product_page(content)
+        return key, [] if record is None else [(prod_id, record)], False
+
+    if html_parser != 'lxml':
+        return key, parse_category_page(content), False
+
+    page_prods = parse_category_page_lxml(content)
+    if not verify:
+        return key, page_prods, False
+
+    expected_prods = parse_category_page(content)
+    if page_prods_to_json(page_prods) != page_prods_to_json(expected_prods):
+        logging.warning(f"lxml and BeautifulSoup parsed {key} differently")
+        return key, expected_prods, True
+    return key, page_prods, False
+
+
+def backfill_date(
+    bucket: str, date: str, processes: int, download_threads: int, chunk_size: int, html_parser: str, verify_every: int
+    ) -> tuple:
+    """Re-parses every archived page of a day.
+
+    Pages are downloaded and parsed chunk_size at a time so only one chunk of raw HTML is held in
+    memory, the parsed records of every page are kept until the day is merged.
+
+    Args:
+        bucket (str): S3 bucket containing archived raw HTML
+        date (str): Date to backfill in "YYYY-MM-DD" format
+        processes (int): Number of parser processes
+        download_threads (int): Number of threads downloading archived pages
+        chunk_size (int): Number of pages to download and parse at a time
+        html_parser (str): lxml to parse category pages with lxml XPath queries, or html.parser
+        verify_every (int): Check every verify_every'th page against the lambda functions' parser
+
+    Returns:
+        prod_dict (dict): Details of products, or None if nothing was archived for the date
+        mismatches (int): Number of verified pages the two parsers disagreed on
+    """
+    from utilities import s3, ProductBatch
+
+    client = s3.meta.client
+    keys = []
+    for page in client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=f"raw_html/{date}/"):
+        keys.extend(obj['Key'] for obj in page.get('Contents', []))
+    if len(keys) == 0:
+        logging.warning(f"No archived raw HTML found for {date}, skipping")
+        return None, 0
+    logging.info(f"Found {len(keys)} archived pages for {date}")
+
+    # Within a chunk, hand each page to the parser processes as soon as it has downloaded
+    page_results = {}
+    verified, mismatches = 0, 0
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=download_threads) as download_pool, \
+            ProcessPoolExecutor(max_workers=processes) as parse_pool:
+        for chunk_start in range(0, len(keys), chunk_size):
+            downloads = {
+                download_pool.submit(lambda key: (key, client.get_object(Bucket=bucket, Key=key)['Body'].read()), key):
+                    (verify_every > 0) and ((chunk_start + idx) % verify_every == 0) and ('/category_pages/' in key)
+                for idx, key in enumerate(keys[chunk_start: chunk_start + chunk_size])
+            }
+            parses = [
+                parse_pool.submit(parse_archived_page, *download.result(), html_parser, downloads[download])
+                for download in as_completed(downloads)
+            ]
+            verified += sum(downloads.values())
+            del downloads
+            for parse in as_completed(parses):
+                key, page_prods, mismatch = parse.result()
+                page_results[key] = page_prods
+                mismatches += mismatch
+            del parses
+    elapsed = time.time() - start_time
+    logging.info(
+        f"Downloaded and parsed {len(keys)} pages in {elapsed:.1f}s ({len(keys) / elapsed:.0f} pages/s) "
+        f"with {processes} processes using {html_parser}"
+    )
+    if html_parser == 'lxml':
+        logging.info(f"Checked {verified} pages against the lambda functions' parser, {mismatches} differed")
+
+    # Merge in key order so product pages overwrite category pages, same as in the pipeline
+    prod_batch = ProductBatch()
+    for key in sorted(page_results.keys()):
+        for prod_id, record in page_results[key]:
+            prod_batch.add(prod_id, record)
+    logging.info(f"Parsed {len(prod_batch)} products for {date}")
+
+    # Round trip through JSON so missing values match what the pipeline reads back from S3
+    return json.loads(prod_batch.to_json_bytes()), mismatches
+
+
+def load_function_module(function_dir: str):
+    """Imports the app module of a lambda function, their folder names aren't valid package names."""
+    spec = importlib.util.spec_from_file_location(
+        f"{function_dir}_app", os.path.join(ROOT_DIR, 'functions', function_dir, 'app.py')
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--bucket', required=True, help="S3 bucket containing archived raw HTML and master data")
+    parser.add_argument('--dates', required=True, nargs='+', help="Dates to backfill in YYYY-MM-DD format")
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help="Number of parser processes")
+    parser.add_argument('--download-threads', type=int, default=32, help="Number of download threads")
+    parser.add_argument('--chunk-size', type=int, default=2000, help="Number of pages to hold in memory at a time")
+    parser.add_argument(
+        '--html-parser', choices=['lxml', 'html.parser'], default=DEFAULT_HTML_PARSER,
+        help="Parse category pages with lxml XPath queries, or exactly as the lambda functions do"
+    )
+    parser.add_argument(
+        '--verify-every', type=int, default=20,
+        help="Also parse every nth page with the lambda functions' parser when using lxml and compare, 0 to disable"
+    )
+    parser.add_argument('--endpoint-url', default=None, help="Endpoint of a local S3 stand-in")
+    parser.add_argument('--dry-run', action='store_true', help="Parse pages without rewriting the master table")
+    args = parser.parse_args()
+
+    # Needs to be set before boto3 is first imported by utilities
+    storage_options = None
+    if args.endpoint_url:
+        os.environ['AWS_ENDPOINT_URL_S3'] = args.endpoint_url
+        storage_options = {'client_kwargs': {'endpoint_url': args.endpoint_url}}
+
+    import pandas as pd
+    postprocess_app = load_function_module('6_postprocess_all_data')
+
+    backfilled_dfs = []
+    backfilled_dates = []
+    total_mismatches = 0
+    for date in args.dates:
+        prod_dict, mismatches = backfill_date(
+            args.bucket, date, args.processes, args.download_threads, args.chunk_size, args.html_parser, args.verify_every
+        )
+        total_mismatches += mismatches
+        if prod_dict:
+            backfilled_dfs.append(postprocess_app.postprocess_products(prod_dict, date))
+            backfilled_dates.append(date)
+
+    if len(backfilled_dfs) == 0 or args.dry_run:
+        return
+
+    # Unverified pages may have been parsed differently too, so don't write a partly wrong backfill
+    if total_mismatches > 0:
+        logging.error(
+            f"lxml and BeautifulSoup disagreed on {total_mismatches} pages, not rewriting the master table. "
+            "Rerun with --html-parser html.parser to parse pages exactly as the lambda functions do"
+        )
+        sys.exit(1)
+
+    # Replace the backfilled days in the master scraped data table
+    master_data_path = f"s3://{args.bucket}/master_data/scraped_product_data.parquet"
+    master_df = pd.read_parquet(master_data_path, storage_options=storage_options)
+    logging.info(f"Number of rows in master scraped data table: {len(master_df)}")
+
+    master_df = master_df[~master_df['date'].astype(str).isin(backfilled_dates)]
+    master_df = pd.concat([master_df] + backfilled_dfs)
+    master_df.to_parquet(master_data_path, storage_options=storage_options)
+    logging.info(f"Rewrote {backfilled_dates} in master scraped data table, now has {len(master_df)} rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+import os
+import sys
+import gzip
+import importlib.util
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'util_layer'))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'tests'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+
+import parsers
+from test_parsers import PAGE, lxml_only
+
+spec = importlib.util.spec_from_file_location(
+    "backfill_raw_html", os.path.join(ROOT_DIR, 'scripts', 'backfill_raw_html.py')
+)
+backfill = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(backfill)
+
+KEY = "raw_html/2022-04-01/category_pages/fresh-food/1.html.gz"
+
+
+@lxml_only
+def test_parse_archived_page_verified_page_matches():
+    key, page_prods, mismatch = backfill.parse_archived_page(KEY, gzip.compress(PAGE), 'lxml', verify=True)
+
+    assert key == KEY
+    assert not mismatch
+    assert backfill.page_prods_to_json(page_prods) == backfill.page_prods_to_json(parsers.parse_category_page(PAGE))
+
+
+@lxml_only
+def test_parse_archived_page_uses_lambda_parser_on_mismatch(monkeypatch):
+    monkeypatch.setattr(parsers, 'parse_category_page_lxml', lambda content: parsers.parse_category_page(content)[:1])
+
+    _, page_prods, mismatch = backfill.parse_archived_page(KEY, gzip.compress(PAGE), 'lxml', verify=True)
+    assert mismatch
+    assert len(page_prods) == 2
+
+    _, page_prods, mismatch = backfill.parse_archived_page(KEY, gzip.compress(PAGE), 'lxml', verify=False)
+    assert not mismatch
+    assert len(page_prods) == 1
@@ -0,0 +1,68 @@
+import os
+import sys
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'util_layer'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+
+import parsers
+
+lxml_only = pytest.mark.skipif(parsers.lxml is None, reason="lxml isn't installed")
+
+
+def make_tile(prod_id, hrefs, name="Tesco Bananas Loose", price="£0.15", subtext="£0.76/kg"):
+    """Builds the HTML of a product tile on a category page, fields set to None are left out."""
+    anchors = "".join(
+        f'<a class="styled__Anchor-sc-1xbujuz-0 cFilde beans-link__anchor" href="{href}">'
+        + (f'<span class="styled__Text-sc-1xbujuz-1 ldbwMG beans-link__text">{name}</span>' if name is not None else '')
+        + '</a>'
+        for href in hrefs
+    )
+    return (
+        '<li class="product-list--list-item">'
+        f'<div class="styles__StyledTiledContent-dvv1wj-3 bcglTg" data-auto-id="{prod_id}">'
+        + anchors
+        + (f'<p class="styled__StyledHeading-sc-119w3hf-2 jWPEtj styled__Text-sc-8qlq5b-1 lnaeiZ beans-price__text">{price}</p>' if price is not None else '')
+        + (f'<p class="styled__StyledFootnote-sc-119w3hf-7 icrlVF styled__Subtext-sc-8qlq5b-2 bNJmdc beans-price__subtext">{subtext}</p>' if subtext is not None else '')
+        + '</div></li>'
+    )
+
+
+def make_page(*tiles):
+    return f'<html><head></head><body><ul>{"".join(tiles)}</ul></body></html>'.encode('utf-8')
+
+
+PAGE = make_page(
+    make_tile(1, [
+        "/groceries/en-GB/shop/fresh-food/fresh-fruit/bananas/loose-bananas",
+        "/groceries/en-GB/shop/fresh-food/fresh-fruit",
+    ]),
+    make_tile(2, ["/groceries/en-GB/products/2", "/groceries/en-GB/shop/fresh-food/fresh-fruit"], price=None, subtext=None),
+)
+
+
+def test_parse_category_page_merges_category_levels_across_anchors():
+    page_prods = dict(parsers.parse_category_page(PAGE))
+
+    assert page_prods[1].categories == ('fresh-food', 'fresh-fruit', 'bananas', 'loose-bananas')
+    assert page_prods[2].categories == ('fresh-food', 'fresh-fruit')
+
+
+@lxml_only
+def test_parse_category_page_lxml_matches_beautifulsoup():
+    bs4_prods = parsers.parse_category_page(PAGE)
+    lxml_prods = parsers.parse_category_page_lxml(PAGE)
+
+    assert [prod_id for prod_id, _ in lxml_prods] == [prod_id for prod_id, _ in bs4_prods]
+    for (_, bs4_record), (_, lxml_record) in zip(bs4_prods, lxml_prods):
+        assert list(lxml_record.iter_json_chunks()) == list(bs4_record.iter_json_chunks())
+
+
+@lxml_only
+@pytest.mark.parametrize("parse_fn", [parsers.parse_category_page, parsers.parse_category_page_lxml])
+def test_parse_category_page_raises_on_missing_name(parse_fn):
+    page = make_page(make_tile(1, ["/groceries/en-GB/shop/fresh-food/fresh-fruit"], name=None))
+
+    with pytest.raises(AttributeError):
+        parse_fn(page)
@@ -0,0 +1,102 @@
+import os
+import sys
+import random
+import importlib.util
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'util_layer'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+
+spec = importlib.util.spec_from_file_location(
+    "partition_categories_app", os.path.join(ROOT_DIR, 'functions', '1_partition_categories', 'app.py')
+)
+app = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(app)
+
+
+def get_partition_pages(partitions):
+    """Returns the number of pages in each partition and the set of (category, page) pairs covered."""
+    partition_sizes = []
+    covered = []
+    for part_list in partitions:
+        partition_sizes.append(sum(d['end_index'] - d['start_index'] + 1 for d in part_list))
+        for d in part_list:
+            covered.extend((d['category'], page) for page in range(d['start_index'], d['end_index'] + 1))
+    return partition_sizes, covered
+
+
+def test_partition_list_many_small_subcategories():
+    rng = random.Random(0)
+    groc_cat_pages = {f"category/sub-{i}": rng.randint(1, 4) for i in range(120)}
+    total_pages = sum(groc_cat_pages.values())
+
+    partitions = app.partition_list(groc_cat_pages, 50)
+    partition_sizes, covered = get_partition_pages(partitions)
+
+    assert max(partition_sizes) <= 50
+    assert all(size == 50 for size in partition_sizes[:-1])
+    assert len(partitions) == -(-total_pages // 50)
+    assert len(covered) == len(set(covered)) == total_pages
+    assert set(covered) == {(cat, page) for cat, pages in groc_cat_pages.items() for page in range(1, pages + 1)}
+
+
+def test_partition_list_splits_large_categories():
+    groc_cat_pages = {'fresh-food': 120, 'bakery': 1, 'frozen-food': 49, 'drinks': 0}
+
+    partitions = app.partition_list(groc_cat_pages, 50)
+    partition_sizes, covered = get_partition_pages(partitions)
+
+    assert partition_sizes == [50, 50, 50, 20]
+    assert len(covered) == len(set(covered)) == 170
+    assert partitions[2] == [
+        {'category': 'fresh-food', 'start_index': 101, 'end_index': 120},
+        {'category': 'bakery', 'start_index': 1, 'end_index': 1},
+        {'category': 'frozen-food', 'start_index': 1, 'end_index': 29},
+    ]
+
+
+def test_get_page_num_per_category_falls_back_to_whole_category():
+    category_tree = {
+        'bakery': {
+            'num_items': 100,
+            'updated': '2022-04-01',
+            'subcategories': {'bakery/bread': 60, 'bakery/cakes': 40}
+        },
+        'drinks': {
+            'num_items': 100,
+            'updated': '2022-04-01',
+            'subcategories': {'drinks/tea': 60}
+        },
+        'frozen-food': {
+            'num_items': 49,
+            'updated': '2022-04-01',
+            'subcategories': {}
+        },
+    }
+
+    groc_cat_pages, groc_cat_num_items = app.get_page_num_per_category(category_tree)
+
+    assert groc_cat_pages == {'bakery/bread': 2, 'bakery/cakes': 1, 'drinks': 3, 'frozen-food': 2}
+    assert groc_cat_num_items == {'bakery': 100, 'drinks': 100, 'frozen-food': 49}
+
+
+def test_update_category_tree_skips_subcategories_that_cant_be_counted(monkeypatch):
+    counts = {'bakery': 100, 'bakery/bread': 60, 'bakery/cakes': 40, 'drinks': 100, 'drinks/tea': 60}
+    subcategories = {'bakery': ['bakery/bread', 'bakery/cakes'], 'drinks': ['drinks/tea', 'drinks/seasonal']}
+
+    def get_category_page(category_path, proxies, user_agent):
+        # Pages without a product count fail to parse the same way as the real function
+        if category_path not in counts:
+            raise AttributeError("'NoneType' object has no attribute 'get_text'")
+        return counts[category_path], category_path
+
+    monkeypatch.setattr(app, 'get_category_page', get_category_page)
+    monkeypatch.setattr(app, 'get_subcategories', lambda groc_cat, soup: subcategories[groc_cat])
+    monkeypatch.setattr(app.time, 'sleep', lambda secs: None)
+
+    user_agents = {0: {'useragent': 'test'}, 1: {'useragent': 'test'}}
+    category_tree = app.update_category_tree({}, ['bakery', 'drinks'], {}, user_agents, max_age_days=7)
+
+    assert category_tree['bakery']['subcategories'] == {'bakery/bread': 60, 'bakery/cakes': 40}
+    assert category_tree['drinks']['subcategories'] == {}
+    assert app.get_page_num_per_category(category_tree)[0] == {'bakery/bread': 2, 'bakery/cakes': 1, 'drinks': 3}
@@ -0,0 +1,118 @@
+import os
+import sys
+import time
+import random
+import threading
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, 'util_layer'))
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-2')
+
+from utilities import fetch_and_parse
+
+
+def parse_page(content):
+    """Module level so it can be pickled to parser processes."""
+    if content == "bad page":
+        raise ValueError("Could not parse page")
+    return content.upper(), os.getpid()
+
+
+def wait_for_fetchers(num_threads, timeout=5):
+    """Waits for fetcher threads to exit, they check for a stop every second."""
+    deadline = time.time() + timeout
+    while threading.active_count() > num_threads and time.time() < deadline:
+        time.sleep(0.05)
+    return threading.active_count()
+
+
+def test_fetch_and_parse_yields_in_order_with_several_fetchers():
+    rng = random.Random(0)
+    delays = [rng.uniform(0, 0.01) for _ in range(200)]
+
+    def fetch(job):
+        time.sleep(delays[job])
+        return f"page {job}"
+
+    results = list(fetch_and_parse(list(range(200)), fetch, lambda content: content, num_fetchers=8, max_in_flight=16))
+
+    assert results == [(job, f"page {job}") for job in range(200)]
+
+
+def test_fetch_and_parse_handles_no_jobs():
+    assert list(fetch_and_parse([], lambda job: job, lambda content: content, num_fetchers=4)) == []
+
+
+@pytest.mark.parametrize("max_in_flight", [1, 4, 10])
+def test_fetch_and_parse_bounds_pages_in_flight_behind_a_slow_page(max_in_flight):
+    started = []
+    started_lock = threading.Lock()
+    release_first_page = threading.Event()
+
+    def fetch(job):
+        with started_lock:
+            started.append(job)
+        if job == 0:
+            release_first_page.wait(timeout=5)
+        return job
+
+    # Let the other fetchers run for a while before the first page comes back
+    threading.Timer(0.3, release_first_page.set).start()
+
+    num_fetchers = min(4, max_in_flight)
+    for num_yielded, (job, result) in enumerate(
+        fetch_and_parse(list(range(100)), fetch, lambda content: content, num_fetchers=num_fetchers, max_in_flight=max_in_flight), 1
+    ):
+        # The slot of the job being yielded has already been freed
+        with started_lock:
+            assert len(started) <= max_in_flight + num_yielded
+        assert job == result
+
+        # Slow consumer, fetchers mustn't run ahead of it either
+        if num_yielded % 10 == 0:
+            time.sleep(0.05)
+
+    assert sorted(started) == list(range(100))
+
+
+@pytest.mark.parametrize("num_parsers", [0, 2])
+def test_fetch_and_parse_raises_fetch_errors_in_order(num_parsers):
+    def fetch(job):
+        if job == 5:
+            raise ConnectionError("Could not fetch page")
+        return f"page {job}"
+
+    num_threads = threading.active_count()
+    yielded = []
+    with pytest.raises(ConnectionError):
+        for job, result in fetch_and_parse(list(range(50)), fetch, parse_page, num_fetchers=4, num_parsers=num_parsers):
+            yielded.append(job)
+
+    assert yielded == [0, 1, 2, 3, 4]
+    assert wait_for_fetchers(num_threads) <= num_threads
+
+
+@pytest.mark.parametrize("num_parsers", [0, 2])
+def test_fetch_and_parse_raises_parse_errors_in_order(num_parsers):
+    def fetch(job):
+        return "bad page" if job == 7 else f"page {job}"
+
+    yielded = []
+    with pytest.raises(ValueError, match="Could not parse page"):
+        for job, result in fetch_and_parse(list(range(50)), fetch, parse_page, num_fetchers=4, num_parsers=num_parsers):
+            yielded.append(job)
+
+    assert yielded == list(range(7))
+
+
+def test_fetch_and_parse_parses_in_processes():
+    def fetch(job):
+        time.sleep(0.001)
+        return f"page {job}"
+
+    results = list(fetch_and_parse(list(range(100)), fetch, parse_page, num_fetchers=4, num_parsers=2, max_in_flight=8))
+
+    assert [job for job, _ in results] == list(range(100))
+    assert [parsed for _, (parsed, _) in results] == [f"PAGE {job}" for job in range(100)]
+    assert os.getpid() not in {pid for _, (_, pid) in results}
@@ -0,0 +1,264 @@
+"""Contains functions that parse the HTML of Tesco pages, shared by the scraping lambda functions
+and the raw HTML backfill script."""
+import re
+import numpy as np
+from bs4 import BeautifulSoup, SoupStrainer, UnicodeDammit
+from utilities import ProductRecord
+
+# lxml isn't installed in the lambda functions, only the backfill script uses it
+try:
+    import lxml.html
+    UTF8_HTML_PARSER = lxml.html.HTMLParser(encoding='utf-8')
+except ImportError:
+    lxml = None
+
+
+def parse_category_page(content: bytes, html_parser: str = "html.parser") -> list:
+    """Parse a page of products to get price per unit, price per weight or quantity,
+    product ID, and category hierarchy of each product on it.
+
+    Args:
+        content (bytes): Raw HTML content of the page
+        html_parser (str): Parser for BeautifulSoup to use, e.g. lxml if it's installed
+
+    Returns:
+        page_prods (list): List of (product ID, ProductRecord) tuples
+    """
+    # Only build the tree for product tiles, the rest of the page isn't needed
+    soup = BeautifulSoup(
+        content, html_parser, parse_only=SoupStrainer("li", class_="product-list--list-item")
+    )
+
+    product_list = soup.find_all("li", class_="product-list--list-item")
+
+    page_prods = []
+    for idx, prod in enumerate(product_list, 0):
+        prod_name = prod.find('span', class_="styled__Text-sc-1xbujuz-1 ldbwMG beans-link__text").get_text()
+        prod_id = int(prod.find('div', class_="styles__StyledTiledContent-dvv1wj-3 bcglTg")['data-auto-id'])
+
+        try:
+            prod_price_per_unit = float(
+                (prod
+                 .find('p', class_="styled__StyledHeading-sc-119w3hf-2 jWPEtj styled__Text-sc-8qlq5b-1 lnaeiZ beans-price__text")
+                 .get_text()
+                 .replace('£', '')
+                 .replace(',', '')
+                )
+            )
+        except AttributeError:
+            prod_price_per_unit = np.nan
+
+        try:
+            prod_price_per_weight_quant = float(
+                (prod
+                 .find('p', class_="styled__StyledFootnote-sc-119w3hf-7 icrlVF styled__Subtext-sc-8qlq5b-2 bNJmdc beans-price__subtext")
+                 .get_text()
+                 .split('/')[0]
+                 .replace('£', '')
+                 .replace(',', '')
+                )
+            )
+        except AttributeError:
+            prod_price_per_weight_quant = np.nan
+
+        try:
+            prod_weight_quant_unit = (
+                prod
+                .find('p', class_="styled__StyledFootnote-sc-119w3hf-7 icrlVF styled__Subtext-sc-8qlq5b-2 bNJmdc beans-price__subtext")
+                .get_text()
+                .split('/')[-1]
+            )
+        except AttributeError:
+            prod_weight_quant_unit = np.nan
+
+        try:
+            offer = (
+                prod
+                 .find('div', class_='styles__StyledPromotionsOfferContent-sc-1vdpoop-1 cQQRuD')
+                 .find('span', class_='offer-text')
+                 .get_text()
+            )
+        except AttributeError:
+            offer = np.nan
+
+        # Later anchors overwrite earlier ones level by level, so a shorter path doesn't drop deeper levels
+        cat_dict = {}
+        for ele in prod.find_all('a', class_="styled__Anchor-sc-1xbujuz-0 cFilde beans-link__anchor"):
+            if "/groceries/en-GB/shop/" in ele['href']:
+                for idx, cat in enumerate(ele['href'].split('/')[4:], 1):
+                    cat_dict[idx] = cat
+        categories = tuple(cat_dict[idx] for idx in sorted(cat_dict))
+
+        page_prods.append((prod_id, ProductRecord(
+            name=prod_name,
+            price_per_unit=prod_price_per_unit,
+            price_per_weight_quant=prod_price_per_weight_quant,
+            weight_quant_unit=prod_weight_quant_unit,
+            offer=offer,
+            categories=categories
+        )))
+
+    return page_prods
+
+
+def parse_category_page_lxml(content: bytes) -> list:
+    """Same as parse_category_page but walks the tree with lxml XPath queries instead of building
+    a BeautifulSoup tree, which is over an order of magnitude faster for bulk backfills. Raises if a
+    product's name or ID is missing, like parse_category_page.
+
+    Args:
+        content (bytes): Raw HTML content of the page
+
+    Returns:
+        page_prods (list): List of (product ID, ProductRecord) tuples
+    """
+    def find_text(element, xpath, required=False):
+        matches = element.xpath(xpath)
+        if len(matches) > 0:
+            return matches[0].text_content()
+        # Fail on missing required fields, as parse_category_page does
+        if required:
+            raise AttributeError(f"No element matches {xpath}")
+        return None
+
+    # lxml would otherwise assume latin-1 without a meta charset, pages are UTF-8 but fall back
+    # to detecting the encoding the same way BeautifulSoup does if not
+    try:
+        content.decode('utf-8')
+        tree = lxml.html.document_fromstring(content, parser=UTF8_HTML_PARSER)
+    except UnicodeDecodeError:
+        tree = lxml.html.document_fromstring(UnicodeDammit(content, is_html=True).unicode_markup)
+    product_list = tree.xpath(
+        '//li[contains(concat(" ", normalize-space(@class), " "), " product-list--list-item ")]'
+    )
+
+    page_prods = []
+    for prod in product_list:
+        prod_name = find_text(prod, './/span[@class="styled__Text-sc-1xbujuz-1 ldbwMG beans-link__text"]', required=True)
+        id_divs = prod.xpath('.//div[@class="styles__StyledTiledContent-dvv1wj-3 bcglTg"]')
+        if len(id_divs) == 0:
+            raise AttributeError("No product ID found in product tile")
+        prod_id = int(id_divs[0].get('data-auto-id'))
+
+        price_text = find_text(
+            prod, './/p[@class="styled__StyledHeading-sc-119w3hf-2 jWPEtj styled__Text-sc-8qlq5b-1 lnaeiZ beans-price__text"]'
+        )
+        subtext = find_text(
+            prod, './/p[@class="styled__StyledFootnote-sc-119w3hf-7 icrlVF styled__Subtext-sc-8qlq5b-2 bNJmdc beans-price__subtext"]'
+        )
+        offer_divs = prod.xpath('.//div[@class="styles__StyledPromotionsOfferContent-sc-1vdpoop-1 cQQRuD"]')
+        offer = (
+            find_text(offer_divs[0], './/span[contains(concat(" ", normalize-space(@class), " "), " offer-text ")]')
+            if len(offer_divs) > 0 else None
+        )
+
+        cat_dict = {}
+        for href in prod.xpath('.//a[@class="styled__Anchor-sc-1xbujuz-0 cFilde beans-link__anchor"]/@href'):
+            if "/groceries/en-GB/shop/" in href:
+                for idx, cat in enumerate(href.split('/')[4:], 1):
+                    cat_dict[idx] = cat
+        categories = tuple(cat_dict[idx] for idx in sorted(cat_dict))
+
+        page_prods.append((prod_id, ProductRecord(
+            name=prod_name,
+            price_per_unit=float(price_text.replace('£', '').replace(',', '')) if price_text is not None else np.nan,
+            price_per_weight_quant=(
+                float(subtext.split('/')[0].replace('£', '').replace(',', '')) if subtext is not None else np.nan
+            ),
+            weight_quant_unit=subtext.split('/')[-1] if subtext is not None else np.nan,
+            offer=offer if offer is not None else np.nan,
+            categories=categories
+        )))
+
+    return page_prods
+
+
+def parse_product_page(content: bytes, html_parser: str = "html.parser"):
+    """Parse a product page to get price per unit, price per weight or quantity,
+    and category hierarchy of the product.
+
+    Args:
+        content (bytes): Raw HTML content of the page
+        html_parser (str): Parser for BeautifulSoup to use, e.g. lxml if it's installed
+
+    Returns:
+        ProductRecord, or None if the page is dead
+    """
+    soup = BeautifulSoup(content, html_parser)
+
+    # If can't get product name then it's probably a dead page
+    try:
+        prod_name = soup.find('h1', class_="product-details-tile__title").get_text()
+    except:
+        return None
+
+    try:
+        prod_price_per_unit = float(
+            (soup
+             .find('div', class_="price-per-sellable-unit price-per-sellable-unit--price price-per-sellable-unit--price-per-item")
+             .find('span', class_="value")
+             .get_text()
+             .replace(',', '')
+            )
+        )
+    except AttributeError:
+        prod_price_per_unit = np.nan
+
+    try:
+        prod_price_per_weight_quant = float(
+            (soup
+             .find('div', class_="price-per-quantity-weight")
+             .find('span', class_="value")
+             .get_text()
+             .replace(',', '')
+            )
+        )
+    except AttributeError:
+        prod_price_per_weight_quant = np.nan
+
+    try:
+        prod_weight_quant_unit = (
+            soup
+            .find('div', class_="price-per-quantity-weight")
+            .find('span', class_="weight")
+            .get_text().split('/')[-1]
+        )
+    except AttributeError:
+        prod_weight_quant_unit = np.nan
+
+    try:
+        offer = (
+            soup
+             .find('li', class_='product-promotion')
+             .find('span', class_='offer-text')
+             .get_text()
+        )
+    except AttributeError:
+        offer = None
+
+    # Get category and subcategories of product
+    try:
+        cat_str = re.search(
+            r'(?<={}).*?(?={})'.format('"restOfShelfUrl":', '"template"'),
+            soup.find('body', {'data-app-name': "prd"}).get('data-redux-state').strip()
+        ).group(0)
+    except:
+        cat_str = None
+
+    categories = []
+    replace_list = ["'", "+", ",", '"',]
+    if cat_str:
+        for cat_idx, cat in enumerate(cat_str.split('/')[2:], 1):
+            if cat_idx == 4:
+                for s in replace_list:
+                    cat = cat.replace(s, '')
+            categories.append(cat)
+
+    return ProductRecord(
+        name=prod_name,
+        price_per_unit=prod_price_per_unit,
+        price_per_weight_quant=prod_price_per_weight_quant,
+        weight_quant_unit=prod_weight_quant_unit,
+        offer=offer,
+        categories=categories
+    )
@@ -1,8 +1,43 @@
 """Contains utility functions that are commonly used between lambda functions."""
+import datetime
+import gzip
+import hashlib
+import io
 import json
 import pickle
+import queue
+import sys
+import threading
+import time
+import zlib
 import boto3
-s3 = boto3.resource('s3')
+import botocore
+import botocore.config
+from boto3.s3.transfer import TransferConfig
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+GZIP_MAGIC_NUMBER = b'\x1f\x8b'
+
+# Objects larger than this are read and written in parts concurrently
+PART_SIZE = 8 * 1024 * 1024
+MAX_PART_WORKERS = 8
+
+# Default number of files load_json_many downloads at once
+MAX_LOAD_WORKERS = 8
+
+# Size the connection pool for every load_json_many thread running a full pool of ranged GETs,
+# the default of 10 would make urllib3 keep discarding and reopening connections
+s3 = boto3.resource(
+    's3', config=botocore.config.Config(max_pool_connections=MAX_LOAD_WORKERS * MAX_PART_WORKERS)
+)
+
+# Running totals of bytes transferred to and from S3 by this process, used by StageMetrics
+_io_stats = {'bytes_read': 0, 'bytes_written': 0}
+_io_stats_lock = threading.Lock()
+
+# Encoder used to serialise individual fields of product records, matches json.dumps defaults
+_json_encode = json.JSONEncoder().encode
+
 
 def load_pickle(bucket: str, key: str) -> dict:
     """Loads a pickle file from S3 bucket.
@@ -14,9 +49,7 @@ def load_pickle(bucket: str, key: str) -> dict:
     Returns:
         list or dict
     """
-    content_object = s3.Object(bucket, key)
-    file_content = content_object.get()["Body"].read()
-    return pickle.loads(file_content)
+    return pickle.loads(read_object(bucket, key))
 
 
 def load_json(bucket: str, key: str) -> dict:
@@ -29,9 +62,149 @@ def load_json(bucket: str, key: str) -> dict:
     Returns:
         dict
     """
-    content_object = s3.Object(bucket, key)
-    file_content = content_object.get()["Body"].read().decode("utf-8")
-    return json.loads(file_content)
+    return json.loads(read_object(bucket, key).decode("utf-8"))
+
+
+def load_json_many(paths: list, max_workers: int = MAX_LOAD_WORKERS):
+    """Loads many JSON files from S3 concurrently using a bounded pool of threads.
+    Each file is only parsed as JSON once it has been fully downloaded.
+
+    Args:
+        paths (list): List of (bucket, key) tuples of JSON files
+        max_workers (int): Maximum number of files to download at once
+
+    Yields:
+        dict: Loaded JSON files in the same order as paths, each as soon as it and
+            all the files before it have been loaded
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(load_json, bucket, key) for bucket, key in paths]
+        for future in futures:
+            yield future.result()
+
+
+def read_object(bucket: str, key: str) -> bytes:
+    """Reads the content of an S3 object, decompressing it if it's gzip compressed.
+
+    Objects larger than PART_SIZE are downloaded as concurrent ranged GETs, and each part is
+    gunzipped as soon as it and the parts before it have arrived rather than at the end. Any
+    further decoding (e.g. JSON parsing in load_json) still waits for the whole object.
+    Uses the boto3 client rather than resource so it's safe to call from multiple threads.
+
+    Args:
+        bucket (str): S3 bucket containing the object
+        key (str): Path within bucket of the object
+
+    Returns:
+        bytes
+    """
+    client = s3.meta.client
+    try:
+        response = client.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{PART_SIZE - 1}")
+    except botocore.exceptions.ClientError as ex:
+        # Ranged GETs of empty objects aren't satisfiable
+        if ex.response['Error']['Code'] == 'InvalidRange':
+            return b''
+        raise
+    first_part = response['Body'].read()
+    _count_io('bytes_read', len(first_part))
+    total_size = int(response.get('ContentRange', f"/{len(first_part)}").split('/')[-1])
+
+    # wbits=31 expects a gzip header and trailer
+    decompressor = zlib.decompressobj(wbits=31) if first_part[:2] == GZIP_MAGIC_NUMBER else None
+    decode = decompressor.decompress if decompressor else bytes
+    chunks = [decode(first_part)]
+
+    if total_size > PART_SIZE:
+        ranges = [
+            f"bytes={start}-{min(start + PART_SIZE, total_size) - 1}"
+            for start in range(PART_SIZE, total_size, PART_SIZE)
+        ]
+        with ThreadPoolExecutor(max_workers=MAX_PART_WORKERS) as executor:
+            futures = [
+                executor.submit(
+                    lambda byte_range: client.get_object(Bucket=bucket, Key=key, Range=byte_range)['Body'].read(),
+                    byte_range
+                )
+                for byte_range in ranges
+            ]
+            for future in futures:
+                part = future.result()
+                _count_io('bytes_read', len(part))
+                chunks.append(decode(part))
+
+    if decompressor:
+        chunks.append(decompressor.flush())
+    return b''.join(chunks)
+
+
+def save_compressed(bucket: str, prefix: str, body, extension: str = 'json') -> str:
+    """Saves gzip compressed content to S3 under a key derived from a hash of the content,
+    so saving identical content again (e.g. when a step function task is retried) reuses
+    the existing object instead of uploading a duplicate.
+
+    The body can be given as an iterable of string chunks (e.g. ProductBatch.iter_json_chunks()),
+    which are hashed and compressed one at a time so the uncompressed content is never held in
+    memory all at once.
+
+    Args:
+        bucket (str): S3 bucket to save to
+        prefix (str): Start of the key, the content hash and extension are appended to it
+        body (bytes or iterable of str): Uncompressed content to save
+        extension (str): File extension of the uncompressed content
+
+    Returns:
+        key (str): Path within bucket of the saved object
+    """
+    chunks = [body] if isinstance(body, bytes) else (chunk.encode('UTF-8') for chunk in body)
+    hasher = hashlib.sha256()
+    compressed_buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=compressed_buffer, mode='wb', mtime=0) as gzip_file:
+        for chunk in chunks:
+            hasher.update(chunk)
+            gzip_file.write(chunk)
+    key = f"{prefix}{hasher.hexdigest()[:32]}.{extension}.gz"
+
+    # Skip the upload if an object with identical content already exists
+    try:
+        s3.meta.client.head_object(Bucket=bucket, Key=key)
+        return key
+    except botocore.exceptions.ClientError as ex:
+        if ex.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+            raise
+
+    # Large objects are uploaded as a multipart upload with parts sent concurrently
+    _count_io('bytes_written', compressed_buffer.tell())
+    compressed_buffer.seek(0)
+    s3.meta.client.upload_fileobj(
+        compressed_buffer,
+        bucket,
+        key,
+        Config=TransferConfig(
+            multipart_threshold=PART_SIZE,
+            multipart_chunksize=PART_SIZE,
+            max_concurrency=MAX_PART_WORKERS
+        )
+    )
+    return key
+
+
+def archive_raw_html(bucket: str, key: str, content: bytes):
+    """Saves gzip compressed raw HTML of a scraped page to S3 so it can be re-parsed later.
+    Uses the boto3 client rather than resource as it's safe to call from fetcher threads.
+
+    Args:
+        bucket (str): S3 bucket to save to
+        key (str): Path within bucket to save to, should end in .html.gz
+        content (bytes): Raw HTML content of the page
+    """
+    compressed_content = gzip.compress(content, mtime=0)
+    _count_io('bytes_written', len(compressed_content))
+    s3.meta.client.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=compressed_content
+    )
 
 
 def load_proxy_details(bucket: str, key: str) -> tuple:
@@ -62,4 +235,299 @@ def load_proxy_details(bucket: str, key: str) -> tuple:
         'http': http_connection
     }
 
-    return proxy_dict, proxy_details["expiry"]
\ No newline at end of file
+    return proxy_dict, proxy_details["expiry"]
+
+
+class StageMetrics:
+    """Collects telemetry for one invocation of a lambda function, which is saved under
+    telemetry/ in S3 for the run metrics report at the end of the pipeline.
+
+    Measures the duration of the invocation and the bytes read from and written to S3
+    through this module, transfers made elsewhere (e.g. by pandas) are added with
+    add_bytes_read and add_bytes_written. Other metrics (e.g. pages scraped) are set like a dict.
+    """
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.values = {}
+        self._start_time = time.time()
+        self._other_io_stats = {'bytes_read': 0, 'bytes_written': 0}
+        with _io_stats_lock:
+            self._start_io_stats = dict(_io_stats)
+
+    def __setitem__(self, name: str, value):
+        self.values[name] = value
+
+    def add_bytes_read(self, num_bytes: int):
+        """Adds bytes read from S3 without going through this module."""
+        self._other_io_stats['bytes_read'] += num_bytes
+
+    def add_bytes_written(self, num_bytes: int):
+        """Adds bytes written to S3 without going through this module."""
+        self._other_io_stats['bytes_written'] += num_bytes
+
+    def save(self, bucket: str) -> str:
+        """Saves the collected metrics to S3.
+
+        Args:
+            bucket (str): S3 bucket to save to
+
+        Returns:
+            key (str): Path within bucket of the saved metrics
+        """
+        with _io_stats_lock:
+            io_stats = {
+                stat: _io_stats[stat] - self._start_io_stats[stat] + self._other_io_stats[stat]
+                for stat in _io_stats
+            }
+
+        metrics = {
+            'stage': self.stage,
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'duration_secs': time.time() - self._start_time,
+            **io_stats,
+            **self.values
+        }
+        # Dated in UTC to match the start date of the step function execution
+        curr_date = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d")
+        return save_compressed(
+            bucket, f"telemetry/{curr_date}/{self.stage}_", json.dumps(metrics).encode('UTF-8')
+        )
+
+
+class ProductRecord:
+    """Compact container for the scraped details of a single product.
+
+    Uses __slots__ so that no per-instance __dict__ is allocated, and the category
+    hierarchy is held as a tuple of interned strings rather than category_n keys.
+    """
+    __slots__ = (
+        'name',
+        'price_per_unit',
+        'price_per_weight_quant',
+        'weight_quant_unit',
+        'offer',
+        'categories'
+    )
+
+    def __init__(
+        self,
+        name: str,
+        price_per_unit: float,
+        price_per_weight_quant: float,
+        weight_quant_unit,
+        offer,
+        categories: tuple = ()
+    ):
+        self.name = name
+        self.price_per_unit = price_per_unit
+        self.price_per_weight_quant = price_per_weight_quant
+        self.weight_quant_unit = _intern(weight_quant_unit)
+        self.offer = offer
+        self.categories = tuple(_intern(cat) for cat in categories)
+
+    def __reduce__(self):
+        # Rebuild through __init__ so strings are re-interned after crossing a process boundary
+        return (
+            ProductRecord,
+            (
+                self.name,
+                self.price_per_unit,
+                self.price_per_weight_quant,
+                self.weight_quant_unit,
+                self.offer,
+                self.categories
+            )
+        )
+
+    def iter_json_chunks(self):
+        """Yields the JSON encoding of the record in pieces, in the same layout as
+        json.dumps of the equivalent product dict.
+        """
+        yield '{"name": '
+        yield _json_encode(self.name)
+        yield ', "price_per_unit": '
+        yield _json_encode(self.price_per_unit)
+        yield ', "price_per_weight_quant": '
+        yield _json_encode(self.price_per_weight_quant)
+        yield ', "weight_quant_unit": '
+        yield _json_encode(self.weight_quant_unit)
+        yield ', "offer": '
+        yield _json_encode(self.offer)
+        for idx, cat in enumerate(self.categories, 1):
+            yield f', "category_{idx}": '
+            yield _json_encode(cat)
+        yield '}'
+
+
+class ProductBatch:
+    """Batch of ProductRecords keyed by product ID that is filled incrementally by the
+    scrapers and serialised straight to JSON bytes without building intermediate dicts.
+
+    Adding a product ID that is already in the batch overwrites its record, same as
+    dict.update did previously.
+    """
+    __slots__ = ('_records',)
+
+    def __init__(self):
+        self._records = {}
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __contains__(self, prod_id) -> bool:
+        return str(prod_id) in self._records
+
+    def keys(self):
+        """Returns a view of the product IDs (as strings) in the batch."""
+        return self._records.keys()
+
+    def add(self, prod_id, record: ProductRecord):
+        """Adds or overwrites the record for a product.
+
+        Args:
+            prod_id (int or str): Tesco product ID
+            record (ProductRecord): Scraped details of the product
+        """
+        self._records[str(prod_id)] = record
+
+    def update(self, other):
+        """Merges another ProductBatch, or a dict loaded from a scraped JSON file, into this batch.
+
+        Args:
+            other (ProductBatch or dict): Products to merge in, later values overwrite earlier ones
+        """
+        if isinstance(other, ProductBatch):
+            self._records.update(other._records)
+            return
+
+        for prod_id, prod in other.items():
+            self._records[str(prod_id)] = ProductRecord(
+                name=prod['name'],
+                price_per_unit=prod['price_per_unit'],
+                price_per_weight_quant=prod['price_per_weight_quant'],
+                weight_quant_unit=prod['weight_quant_unit'],
+                offer=prod['offer'],
+                categories=tuple(prod[key] for key in prod if key.startswith('category_'))
+            )
+
+    def iter_json_chunks(self):
+        """Yields the JSON encoding of the batch in pieces, one product at a time."""
+        yield '{'
+        for idx, (prod_id, record) in enumerate(self._records.items()):
+            separator = ', ' if idx > 0 else ''
+            yield f"{separator}{_json_encode(prod_id)}: {''.join(record.iter_json_chunks())}"
+        yield '}'
+
+    def to_json_bytes(self) -> bytes:
+        """Serialises the batch into UTF-8 encoded JSON bytes ready to be put into S3.
+
+        Returns:
+            bytes
+        """
+        return ''.join(self.iter_json_chunks()).encode('UTF-8')
+
+
+def fetch_and_parse(
+    jobs: list, fetch_fn, parse_fn, num_fetchers: int = 1, num_parsers: int = 0, max_in_flight: int = 4
+    ):
+    """Streams jobs through a producer/consumer pipeline. Fetcher threads call fetch_fn on each
+    job and push the raw page content onto a queue, and pages are parsed with parse_fn either on
+    the calling thread or in a pool of parser processes. Results are yielded in the same order
+    as jobs.
+
+    Backpressure is a window over job numbers: a fetcher has to take a slot before starting a
+    job, and the slot is only freed once that job's result has been yielded. So at most
+    max_in_flight pages are being fetched, queued, parsed or waiting on an earlier slow page at
+    any time, whatever order they finish in.
+
+    Note that multiprocessing isn't supported inside AWS Lambda (no /dev/shm) so num_parsers
+    should be left at 0 there, parsing still overlaps with fetching on the calling thread.
+
+    Args:
+        jobs (list): Items to pass to fetch_fn, e.g. URLs
+        fetch_fn (callable): Takes a job and returns the raw content of the page
+        parse_fn (callable): Takes raw page content and returns the parsed result, must be
+            picklable (i.e. a module level function) if num_parsers > 1
+        num_fetchers (int): Number of fetcher threads
+        num_parsers (int): Number of parser processes, 0 or 1 parses on the calling thread
+        max_in_flight (int): Maximum number of jobs started but not yet yielded, raised to
+            num_fetchers if lower
+
+    Yields:
+        tuple: (job, parsed result)
+    """
+    num_fetchers = max(1, min(num_fetchers, len(jobs)))
+    window = threading.Semaphore(max(max_in_flight, num_fetchers))
+    raw_queue = queue.Queue()
+    stop_event = threading.Event()
+    job_iter = iter(enumerate(jobs))
+    job_lock = threading.Lock()
+
+    def fetcher():
+        while not stop_event.is_set():
+            if not window.acquire(timeout=1):
+                continue
+            with job_lock:
+                seq, job = next(job_iter, (None, None))
+            if seq is None:
+                window.release()
+                break
+            try:
+                raw_queue.put((seq, fetch_fn(job), None))
+            except Exception as ex:
+                raw_queue.put((seq, None, ex))
+        # Signal the consumer that this fetcher is done
+        raw_queue.put((None, None, None))
+
+    threads = [threading.Thread(target=fetcher, daemon=True) for _ in range(num_fetchers)]
+    for thread in threads:
+        thread.start()
+
+    executor = ProcessPoolExecutor(max_workers=num_parsers) if num_parsers > 1 else None
+    pending = {}
+    next_seq = 0
+    fetchers_done = 0
+    try:
+        while True:
+            # Yield results in order, waiting on the next one once there's nothing else to take in
+            while next_seq in pending and (pending[next_seq].done() or raw_queue.empty()):
+                result = pending.pop(next_seq).result()
+                window.release()
+                yield jobs[next_seq], result
+                next_seq += 1
+
+            if fetchers_done == num_fetchers:
+                break
+
+            seq, content, ex = raw_queue.get()
+            if seq is None:
+                fetchers_done += 1
+            elif ex is not None:
+                pending[seq] = Future()
+                pending[seq].set_exception(ex)
+            elif executor is not None:
+                pending[seq] = executor.submit(parse_fn, content)
+            else:
+                pending[seq] = Future()
+                try:
+                    pending[seq].set_result(parse_fn(content))
+                except Exception as parse_ex:
+                    pending[seq].set_exception(parse_ex)
+
+    finally:
+        stop_event.set()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _count_io(stat: str, num_bytes: int):
+    """Adds to the running total of bytes read from or written to S3."""
+    with _io_stats_lock:
+        _io_stats[stat] += num_bytes
+
+
+def _intern(value):
+    """Interns strings so repeated category and unit names share a single object."""
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value